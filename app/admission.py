@@ -0,0 +1,243 @@
+import asyncio
+import heapq
+import itertools
+import os
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, generate_latest, REGISTRY
+from prometheus_client import multiprocess
+from starlette.responses import JSONResponse
+
+from app.database import DB_POOL_SIZE, DB_MAX_OVERFLOW
+
+# Prioridades (menor = antes): check-in/finalizar, escrituras, lecturas, informes
+PRIORITY_CHECKIN = 0
+PRIORITY_WRITE = 1
+PRIORITY_READ = 2
+PRIORITY_HEAVY = 3
+
+_RESOURCES = ("/usuarios", "/camiones", "/turnos")
+_CHECKIN = re.compile(r"^/turnos/?$|^/turnos/\d+/finalizar/?$")
+_HEAVY = re.compile(r"^/usuarios/\d+(/estadisticas)?/?$")
+
+
+# Con varios workers, PROMETHEUS_MULTIPROC_DIR (ver gunicorn.conf.py) hace que
+# cada proceso escriba sus valores en ficheros y /metrics los agregue todos
+ADMISSION_LIMIT = Gauge(
+    "admission_limit", "Límite de concurrencia", ["group"], multiprocess_mode="livesum"
+)
+ADMISSION_ACTIVE = Gauge(
+    "admission_active", "Peticiones en curso", ["group"], multiprocess_mode="livesum"
+)
+ADMISSION_QUEUED = Gauge(
+    "admission_queued", "Peticiones en cola", ["group"], multiprocess_mode="livesum"
+)
+ADMISSION_QUEUE_LIMIT = Gauge(
+    "admission_queue_limit", "Longitud máxima de la cola", ["group"], multiprocess_mode="livesum"
+)
+ADMISSION_MAX_WAIT = Gauge(
+    "admission_max_wait_seconds", "Espera máxima en cola", ["group"], multiprocess_mode="max"
+)
+ADMISSION_ADMITTED = Counter("admission_admitted", "Peticiones admitidas", ["group"])
+ADMISSION_REJECTED = Counter("admission_rejected", "Rechazadas por cola llena", ["group"])
+ADMISSION_SHED = Counter("admission_shed", "Descartadas por tiempo en cola", ["group"])
+ADMISSION_QUEUE_SECONDS = Counter("admission_queue_seconds", "Tiempo acumulado en cola", ["group"])
+
+
+def render_metrics() -> bytes:
+    """Métricas en formato de texto de Prometheus, agregadas entre workers"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+class Limiter:
+    """Semáforo con cola acotada por longitud y por tiempo de espera, con prioridad"""
+
+    def __init__(self, name: str, limit: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.queued = 0
+        self._active = ADMISSION_ACTIVE.labels(name)
+        self._queued = ADMISSION_QUEUED.labels(name)
+        self._admitted = ADMISSION_ADMITTED.labels(name)
+        self._rejected = ADMISSION_REJECTED.labels(name)
+        self._shed = ADMISSION_SHED.labels(name)
+        self._queue_seconds = ADMISSION_QUEUE_SECONDS.labels(name)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    async def acquire(self, priority: int, timeout: Optional[float] = None) -> bool:
+        if self.active < self.limit and not self.queued:
+            self._set_active(self.active + 1)
+            self._admitted.inc()
+            return True
+        if self.queued >= self.max_queue:
+            self._rejected.inc()
+            return False
+
+        timeout = self.max_wait if timeout is None else min(timeout, self.max_wait)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._set_queued(self.queued + 1)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            # release() pudo ceder el hueco justo antes de vencer el plazo
+            if future.done() and not future.cancelled():
+                self._admitted.inc()
+                return True
+            self._shed.inc()
+            return False
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            self._set_queued(self.queued - 1)
+            self._queue_seconds.inc(time.monotonic() - start)
+        self._admitted.inc()
+        return True
+
+    def release(self):
+        # Ceder el hueco al siguiente en espera sin decrementar active
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._set_active(self.active - 1)
+
+    def publish_limits(self):
+        ADMISSION_LIMIT.labels(self.name).set(self.limit)
+        ADMISSION_QUEUE_LIMIT.labels(self.name).set(self.max_queue)
+        ADMISSION_MAX_WAIT.labels(self.name).set(self.max_wait)
+
+    def _set_active(self, value: int):
+        self.active = value
+        self._active.set(value)
+
+    def _set_queued(self, value: int):
+        self.queued = value
+        self._queued.set(value)
+
+
+class AdmissionController:
+    """Límites de concurrencia por grupo de rutas más un límite global del pool"""
+
+    def __init__(self, limiters: Dict[str, Limiter], pool: Limiter, retry_after: int):
+        self.limiters = limiters
+        self.pool = pool
+        self.retry_after = retry_after
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        defaults = {
+            # grupo: (límite, cola, espera máxima en segundos)
+            "writes": (8, 50, 5.0),
+            "reads": (10, 50, 2.0),
+            "heavy": (3, 10, 1.0),
+        }
+        limiters = {}
+        for name, (limit, queue, wait) in defaults.items():
+            prefix = f"ADMISSION_{name.upper()}"
+            limiters[name] = Limiter(
+                name,
+                _env_int(f"{prefix}_LIMIT", limit),
+                _env_int(f"{prefix}_QUEUE", queue),
+                _env_float(f"{prefix}_MAX_WAIT", wait),
+            )
+        pool = Limiter(
+            "pool",
+            _env_int("ADMISSION_POOL_LIMIT", DB_POOL_SIZE + DB_MAX_OVERFLOW),
+            _env_int("ADMISSION_POOL_QUEUE", 100),
+            _env_float("ADMISSION_POOL_MAX_WAIT", 5.0),
+        )
+        return cls(limiters, pool, _env_int("ADMISSION_RETRY_AFTER", 1))
+
+    @staticmethod
+    def classify(method: str, path: str) -> Optional[Tuple[str, int]]:
+        """Devuelve (grupo, prioridad) o None si la ruta no usa la base de datos"""
+        if not path.startswith(_RESOURCES):
+            return None
+        if method == "POST" and _CHECKIN.match(path):
+            return "writes", PRIORITY_CHECKIN
+        if method in ("POST", "PUT", "PATCH", "DELETE"):
+            return "writes", PRIORITY_WRITE
+        if _HEAVY.match(path):
+            return "heavy", PRIORITY_HEAVY
+        return "reads", PRIORITY_READ
+
+    async def admit(self, group: str, priority: int) -> bool:
+        limiter = self.limiters[group]
+        deadline = time.monotonic() + limiter.max_wait
+        if not await limiter.acquire(priority):
+            return False
+        try:
+            admitted = await self.pool.acquire(priority, max(deadline - time.monotonic(), 0))
+        except BaseException:
+            limiter.release()
+            raise
+        if not admitted:
+            limiter.release()
+        return admitted
+
+    def release(self, group: str):
+        self.pool.release()
+        self.limiters[group].release()
+
+    def publish_limits(self):
+        """Publica los límites desde el proceso que atiende peticiones.
+
+        Con preload el controlador se crea en el maestro de gunicorn; si los
+        límites se publicaran ahí contarían una sola vez en la suma entre workers.
+        """
+        for limiter in list(self.limiters.values()) + [self.pool]:
+            limiter.publish_limits()
+
+
+class AdmissionMiddleware:
+    """Rechaza con 503 y Retry-After cuando un grupo de rutas está saturado"""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = self.controller.classify(scope["method"], scope["path"])
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        group, priority = route
+        if not await self.controller.admit(group, priority):
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "Servicio saturado, reintente más tarde"},
+                headers={"Retry-After": str(self.controller.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(group)
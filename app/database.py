@@ -15,9 +15,42 @@ DB_NAME = os.getenv("DB_NAME", "BD")
 
 DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_engine(DATABASE_URL, echo=True)
+DB_ECHO = os.getenv("DB_ECHO", "true").lower() == "true"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+
+engine = create_engine(
+    DATABASE_URL,
+    echo=DB_ECHO,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Pool propio y pequeño para el almacén de idempotencia, fuera del límite
+# de admisión que protege al pool principal. Su espera es corta: si se agota,
+# la petición recibe un 503 en lugar de bloquear un hilo del threadpool
+IDEMPOTENCY_POOL_SIZE = int(os.getenv("IDEMPOTENCY_POOL_SIZE", "2"))
+IDEMPOTENCY_MAX_OVERFLOW = int(os.getenv("IDEMPOTENCY_MAX_OVERFLOW", "2"))
+IDEMPOTENCY_POOL_TIMEOUT = float(os.getenv("IDEMPOTENCY_POOL_TIMEOUT", "1"))
+
+idempotency_engine = create_engine(
+    DATABASE_URL,
+    echo=DB_ECHO,
+    pool_size=IDEMPOTENCY_POOL_SIZE,
+    max_overflow=IDEMPOTENCY_MAX_OVERFLOW,
+    pool_timeout=IDEMPOTENCY_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+IdempotencySessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=idempotency_engine)
+
 Base = declarative_base()
 
 # Dependencia para obtener la sesión de la base de datos
@@ -0,0 +1,446 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from app import models
+from app.database import IdempotencySessionLocal
+
+logger = logging.getLogger("app.idempotency")
+
+# Configuración de claves de idempotencia
+IDEMPOTENCY_HEADER = "idempotency-key"
+IDEMPOTENCY_STORE = os.getenv("IDEMPOTENCY_STORE", "memory")
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "30"))
+# Vigencia de una reserva en curso; si el worker muere antes de completarla,
+# la clave vuelve a estar libre al vencer y no tras todo el TTL
+IDEMPOTENCY_LEASE = float(os.getenv("IDEMPOTENCY_LEASE", str(IDEMPOTENCY_WAIT_TIMEOUT)))
+IDEMPOTENCY_RETRY_AFTER = int(os.getenv("IDEMPOTENCY_RETRY_AFTER", "1"))
+IDEMPOTENCY_PURGE_INTERVAL = 300
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+class StoreUnavailable(Exception):
+    """El almacén no respondió (pool agotado o base de datos caída)"""
+
+
+class IdempotencyRecord:
+    """Respuesta almacenada para una clave (status None mientras está en curso)"""
+
+    def __init__(
+        self,
+        fingerprint: str,
+        expires_at: float,
+        status: Optional[int] = None,
+        headers: Optional[Headers] = None,
+        body: bytes = b"",
+    ):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        self.status = status
+        self.headers = headers or []
+        self.body = body
+
+    @property
+    def completed(self) -> bool:
+        return self.status is not None
+
+
+class IdempotencyStore(ABC):
+    """Interfaz de almacenamiento de claves de idempotencia"""
+
+    def check(self) -> None:
+        """Comprueba que el almacén es utilizable; se llama al arrancar cada worker"""
+
+    @abstractmethod
+    def reserve(self, key: str, fingerprint: str, lease: float) -> Optional[IdempotencyRecord]:
+        """Reserva la clave durante lease segundos; devuelve el registro vigente si ya existía"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[IdempotencyRecord]:
+        ...
+
+    @abstractmethod
+    def complete(self, key: str, status: int, headers: Headers, body: bytes, ttl: int) -> None:
+        """Guarda la respuesta y extiende la vigencia de la clave a ttl segundos"""
+
+    @abstractmethod
+    def release(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def purge_expired(self) -> None:
+        ...
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """Almacén en memoria del proceso (un solo worker)"""
+
+    def __init__(self):
+        self._records: Dict[str, IdempotencyRecord] = {}
+        self._lock = threading.Lock()
+        self._last_purge = time.time()
+
+    def reserve(self, key, fingerprint, lease):
+        now = time.time()
+        with self._lock:
+            if now - self._last_purge > IDEMPOTENCY_PURGE_INTERVAL:
+                self._purge(now)
+            record = self._records.get(key)
+            if record and record.expires_at > now:
+                return record
+            self._records[key] = IdempotencyRecord(fingerprint, now + lease)
+            return None
+
+    def get(self, key):
+        with self._lock:
+            record = self._records.get(key)
+            if record and record.expires_at > time.time():
+                return record
+            return None
+
+    def complete(self, key, status, headers, body, ttl):
+        with self._lock:
+            record = self._records.get(key)
+            if record:
+                record.expires_at = time.time() + ttl
+                record.status = status
+                record.headers = headers
+                record.body = body
+
+    def release(self, key):
+        with self._lock:
+            self._records.pop(key, None)
+
+    def purge_expired(self):
+        with self._lock:
+            self._purge(time.time())
+
+    def _purge(self, now: float):
+        expired = [k for k, r in self._records.items() if r.expires_at <= now]
+        for k in expired:
+            del self._records[k]
+        self._last_purge = now
+
+
+class DatabaseIdempotencyStore(IdempotencyStore):
+    """Almacén en la tabla idempotency_keys (compartido entre workers).
+
+    Usa su propio pool (IDEMPOTENCY_POOL_SIZE) para no consumir conexiones
+    del pool que reparte el control de admisión.
+    """
+
+    def __init__(self, session_factory=IdempotencySessionLocal):
+        self._session_factory = session_factory
+        self._last_purge = time.time()
+
+    def check(self):
+        db = self._session_factory()
+        try:
+            table = models.IdempotencyKey.__tablename__
+            if not inspect(db.get_bind()).has_table(table):
+                raise RuntimeError(
+                    f"Falta la tabla {table}; ejecute sql/idempotency_keys.sql "
+                    "o use IDEMPOTENCY_STORE=memory"
+                )
+        finally:
+            db.close()
+
+    @staticmethod
+    def _to_record(row: models.IdempotencyKey) -> IdempotencyRecord:
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in json.loads(row.cabeceras or "[]")]
+        return IdempotencyRecord(
+            row.huella,
+            row.fecha_expiracion.timestamp(),
+            status=row.estado_http,
+            headers=headers,
+            body=row.cuerpo or b"",
+        )
+
+    def reserve(self, key, fingerprint, lease):
+        if time.time() - self._last_purge > IDEMPOTENCY_PURGE_INTERVAL:
+            self.purge_expired()
+        now = datetime.now()
+        db = self._session_factory()
+        try:
+            # Dos intentos: el segundo tras eliminar una clave expirada, ya sea
+            # completada o una reserva cuyo worker murió sin liberarla
+            for _ in range(2):
+                db.add(models.IdempotencyKey(
+                    clave=key,
+                    huella=fingerprint,
+                    fecha_expiracion=now + timedelta(seconds=lease),
+                ))
+                try:
+                    db.commit()
+                    return None
+                except IntegrityError:
+                    db.rollback()
+                row = db.get(models.IdempotencyKey, key)
+                if row is None:
+                    continue
+                if row.fecha_expiracion > now:
+                    return self._to_record(row)
+                db.delete(row)
+                db.commit()
+            row = db.get(models.IdempotencyKey, key)
+            return self._to_record(row) if row else None
+        finally:
+            db.close()
+
+    def get(self, key):
+        db = self._session_factory()
+        try:
+            row = db.get(models.IdempotencyKey, key)
+            if row is None or row.fecha_expiracion <= datetime.now():
+                return None
+            return self._to_record(row)
+        finally:
+            db.close()
+
+    def complete(self, key, status, headers, body, ttl):
+        db = self._session_factory()
+        try:
+            db.query(models.IdempotencyKey).filter(
+                models.IdempotencyKey.clave == key
+            ).update({
+                models.IdempotencyKey.estado_http: status,
+                models.IdempotencyKey.cabeceras: json.dumps(
+                    [(k.decode("latin-1"), v.decode("latin-1")) for k, v in headers]
+                ),
+                models.IdempotencyKey.cuerpo: body,
+                models.IdempotencyKey.fecha_expiracion: datetime.now() + timedelta(seconds=ttl),
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def release(self, key):
+        db = self._session_factory()
+        try:
+            db.query(models.IdempotencyKey).filter(
+                models.IdempotencyKey.clave == key
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def purge_expired(self):
+        self._last_purge = time.time()
+        db = self._session_factory()
+        try:
+            db.query(models.IdempotencyKey).filter(
+                models.IdempotencyKey.fecha_expiracion <= datetime.now()
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    if IDEMPOTENCY_STORE == "db":
+        return DatabaseIdempotencyStore()
+    return MemoryIdempotencyStore()
+
+
+class IdempotencyMiddleware:
+    """Reproduce la respuesta guardada de un POST reintentado con la misma Idempotency-Key.
+
+    Las peticiones sin la cabecera pasan directamente sin consultar el almacén.
+    Los duplicados concurrentes en el mismo proceso esperan a la primera petición;
+    entre procesos se espera sondeando el almacén. Las respuestas 5xx no se guardan
+    para que el cliente pueda reintentar. Si el almacén no responde antes de
+    ejecutar la petición se devuelve 503 con Retry-After, como en el control
+    de admisión.
+    """
+
+    def __init__(
+        self,
+        app,
+        store: Optional[IdempotencyStore] = None,
+        ttl: int = IDEMPOTENCY_TTL,
+        lease: float = IDEMPOTENCY_LEASE,
+    ):
+        self.app = app
+        self.store = store or get_idempotency_store()
+        self.ttl = ttl
+        self.lease = lease
+        self._inflight: Dict[str, asyncio.Event] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        client_key = None
+        for name, value in scope["headers"]:
+            if name == IDEMPOTENCY_HEADER.encode():
+                client_key = value.decode("latin-1").strip()
+                break
+        if not client_key:
+            await self.app(scope, receive, send)
+            return
+        if len(client_key) > 255:
+            await self._error(send, scope, 400, "La Idempotency-Key no puede superar 255 caracteres")
+            return
+
+        body = await self._read_body(receive)
+        key = hashlib.sha256(f"{scope['path']}\n{client_key}".encode()).hexdigest()
+        fingerprint = hashlib.sha256(
+            scope["path"].encode() + b"?" + scope.get("query_string", b"") + b"\n" + body
+        ).hexdigest()
+
+        # Coalescer duplicados concurrentes dentro del mismo proceso
+        while key in self._inflight:
+            try:
+                await asyncio.wait_for(self._inflight[key].wait(), IDEMPOTENCY_WAIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                await self._error(
+                    send, scope, 409,
+                    "Hay una petición en curso con la misma Idempotency-Key",
+                )
+                return
+
+        # El evento se registra antes de reservar para que un duplicado que
+        # llegue durante la reserva espere aquí y no sondeando el almacén
+        event = asyncio.Event()
+        self._inflight[key] = event
+        try:
+            try:
+                record = await self._call_store(self.store.reserve, key, fingerprint, self.lease)
+            except StoreUnavailable:
+                await self._unavailable(send, scope)
+                return
+            if record is None:
+                await self._execute(scope, body, send, key)
+        finally:
+            del self._inflight[key]
+            event.set()
+
+        if record is not None:
+            try:
+                await self._replay_existing(scope, send, key, fingerprint, record)
+            except StoreUnavailable:
+                await self._unavailable(send, scope)
+
+    async def _call_store(self, func, *args):
+        try:
+            return await run_in_threadpool(func, *args)
+        except SQLAlchemyError as exc:
+            raise StoreUnavailable() from exc
+
+    async def _finish(self, func, *args):
+        # La respuesta ya se envió: un fallo aquí solo se registra y la
+        # reserva caduca al vencer su lease
+        try:
+            await run_in_threadpool(func, *args)
+        except SQLAlchemyError:
+            logger.exception("No se pudo actualizar la clave de idempotencia")
+
+    async def _execute(self, scope, body, send, key):
+        sent_body = False
+
+        async def replay_receive():
+            nonlocal sent_body
+            if not sent_body:
+                sent_body = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return {"type": "http.disconnect"}
+
+        status = None
+        headers: Headers = []
+        chunks: List[bytes] = []
+
+        async def capture_send(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            await self._finish(self.store.release, key)
+            raise
+
+        if status is None or status >= 500:
+            await self._finish(self.store.release, key)
+        else:
+            await self._finish(
+                self.store.complete, key, status, headers, b"".join(chunks), self.ttl
+            )
+
+    async def _replay_existing(self, scope, send, key, fingerprint, record):
+        if record.fingerprint != fingerprint:
+            await self._error(
+                send, scope, 422,
+                "La Idempotency-Key ya se usó con una petición distinta",
+            )
+            return
+
+        # Otro worker la está procesando: sondear hasta que termine
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+        delay = 0.05
+        while record is not None and not record.completed:
+            if time.monotonic() > deadline:
+                await self._error(
+                    send, scope, 409,
+                    "Hay una petición en curso con la misma Idempotency-Key",
+                )
+                return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+            record = await self._call_store(self.store.get, key)
+
+        if record is None:
+            # La primera petición falló y liberó la clave
+            await self._error(
+                send, scope, 409,
+                "La petición original con esta Idempotency-Key falló; reintente",
+            )
+            return
+
+        await send({
+            "type": "http.response.start",
+            "status": record.status,
+            "headers": record.headers + [(b"idempotent-replayed", b"true")],
+        })
+        await send({"type": "http.response.body", "body": record.body})
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        return b"".join(chunks)
+
+    @staticmethod
+    async def _error(send, scope, status_code: int, detail: str, headers: Optional[Dict[str, str]] = None):
+        response = JSONResponse(status_code=status_code, content={"detail": detail}, headers=headers)
+        await response(scope, None, send)
+
+    async def _unavailable(self, send, scope):
+        await self._error(
+            send, scope, 503,
+            "Servicio saturado, reintente más tarde",
+            headers={"Retry-After": str(IDEMPOTENCY_RETRY_AFTER)},
+        )
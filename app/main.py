@@ -1,9 +1,13 @@
-import datetime
+from datetime import datetime
 
 from fastapi import FastAPI
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import usuarios, camiones, turnos
 from app.database import engine, Base
+from app.idempotency import IdempotencyMiddleware, get_idempotency_store
+from app.admission import AdmissionController, AdmissionMiddleware, render_metrics
 
 # Crear las tablas en la base de datos (solo para desarrollo)
 # Base.metadata.create_all(bind=engine)
@@ -14,6 +18,19 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Control de admisión por grupo de rutas (límites ADMISSION_* en el entorno)
+admission = AdmissionController.from_env()
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
+@app.on_event("startup")
+def publish_admission_limits():
+    admission.publish_limits()
+
+# Reintentos de POST con Idempotency-Key (IDEMPOTENCY_STORE=memory|db)
+# Cada worker comprueba el almacén al arrancar (app.server.warm_up)
+idempotency_store = get_idempotency_store()
+app.add_middleware(IdempotencyMiddleware, store=idempotency_store)
+
 # Configuración CORS
 app.add_middleware(
     CORSMiddleware,
@@ -43,4 +60,8 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
\ No newline at end of file
+    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
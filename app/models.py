@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, DECIMAL, Enum, Text, ForeignKey, CheckConstraint
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, DECIMAL, Enum, Text, ForeignKey, CheckConstraint, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
@@ -65,4 +65,14 @@ class Turno(Base):
 
     # Relaciones
     usuario = relationship("Usuario", back_populates="turnos")
-    camion = relationship("Camion", back_populates="turnos")
\ No newline at end of file
+    camion = relationship("Camion", back_populates="turnos")
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    clave = Column(String(64), primary_key=True)
+    huella = Column(String(64), nullable=False)
+    estado_http = Column(Integer, nullable=True)
+    cabeceras = Column(Text)
+    cuerpo = Column(LargeBinary(length=16777215))
+    fecha_expiracion = Column(DateTime, nullable=False, index=True)
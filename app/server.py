@@ -0,0 +1,76 @@
+import logging
+import os
+import time
+from contextlib import ExitStack
+
+from uvicorn_worker import UvicornWorker
+
+from app import crud
+from app.database import engine, idempotency_engine, SessionLocal, DB_POOL_SIZE
+
+logger = logging.getLogger("app.server")
+
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+
+class AppUvicornWorker(UvicornWorker):
+    """Worker de uvicorn que termina de drenar antes de que gunicorn lo mate.
+
+    El loop y el parser HTTP quedan en "auto": uvicorn ya elige uvloop y
+    httptools cuando están instalados.
+    """
+
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        "timeout_graceful_shutdown": max(GRACEFUL_TIMEOUT - 5, 1),
+    }
+
+
+def dispose_engine_after_fork():
+    """Descarta las conexiones heredadas del proceso maestro sin cerrarlas"""
+    engine.dispose(close=False)
+    idempotency_engine.dispose(close=False)
+
+
+def warm_up():
+    """Abre las conexiones del pool, compila las consultas habituales y
+    comprueba el almacén de idempotencia.
+
+    Devuelve los segundos empleados. Un fallo de la base de datos no impide
+    arrancar el worker; solo se registra.
+    """
+    start = time.perf_counter()
+    try:
+        # Mantenerlas abiertas a la vez para llenar el pool; ExitStack las
+        # cierra aunque falle una conexión intermedia
+        with ExitStack() as stack:
+            for _ in range(DB_POOL_SIZE):
+                stack.enter_context(engine.connect())
+
+        # Ejecutar una vez cada consulta deja su SQL en la caché de compilación
+        db = SessionLocal()
+        try:
+            # Ids distintos de cero: crud omite los filtros con valores falsos
+            crud.get_usuario(db, usuario_id=1)
+            crud.get_usuario_by_email(db, email="")
+            crud.get_usuarios(db, limit=1)
+            crud.get_camion(db, camion_id=1)
+            crud.get_camion_by_placa(db, placa="")
+            crud.get_camiones(db, limit=1)
+            crud.get_camiones(db, limit=1, usuario_id=1)
+            crud.get_turno(db, turno_id=1)
+            crud.get_turnos(db, limit=1)
+            crud.get_turnos(db, limit=1, usuario_id=1, camion_id=1, activos=True)
+            crud.get_estadisticas_usuario(db, usuario_id=1)
+        finally:
+            db.close()
+    except Exception:
+        logger.exception("Fallo al precalentar la conexión a la base de datos")
+
+    # Importado aquí: gunicorn importa este módulo al cargar worker_class
+    from app.main import idempotency_store
+    try:
+        idempotency_store.check()
+    except Exception:
+        logger.exception("El almacén de idempotencia no está disponible")
+    return time.perf_counter() - start
@@ -0,0 +1,86 @@
+# Configuración de producción: gunicorn app.main:app
+import os
+import shutil
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+_start = time.monotonic()
+
+load_dotenv()
+
+# Valores por defecto de producción, antes de que se importe la aplicación
+os.environ.setdefault("DB_ECHO", "false")
+os.environ.setdefault("IDEMPOTENCY_STORE", "db")
+
+# Métricas de Prometheus agregadas entre workers; el directorio se vacía
+# en cada arranque para no sumar valores de ejecuciones anteriores
+_metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "app_portuaria_metrics")
+)
+shutil.rmtree(_metrics_dir, ignore_errors=True)
+os.makedirs(_metrics_dir)
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = "app.server.AppUvicornWorker"
+preload_app = True
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+loglevel = os.getenv("LOG_LEVEL", "info")
+accesslog = "-"
+
+# Cada worker puede abrir pool_size + max_overflow conexiones más las del
+# pool de idempotencia; no superar el presupuesto de conexiones de MySQL
+_connections_per_worker = (
+    int(os.getenv("DB_POOL_SIZE", "5")) + int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    + int(os.getenv("IDEMPOTENCY_POOL_SIZE", "2")) + int(os.getenv("IDEMPOTENCY_MAX_OVERFLOW", "2"))
+)
+_max_workers = max(int(os.getenv("DB_MAX_CONNECTIONS", "150")) // _connections_per_worker, 1)
+workers = min(int(os.getenv("WEB_CONCURRENCY", "2")), _max_workers)
+
+# El almacén en memoria es por proceso: un reintento en otro worker repetiría el POST
+if workers > 1 and os.environ["IDEMPOTENCY_STORE"] == "memory":
+    raise RuntimeError("IDEMPOTENCY_STORE=memory no es válido con más de un worker; use db")
+
+# Presupuesto de arranque en frío (segundos) para el autoescalado
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", "5"))
+
+
+def when_ready(server):
+    server.log.info("Maestro listo en %.3fs", time.monotonic() - _start)
+    if workers < int(os.getenv("WEB_CONCURRENCY", "2")):
+        server.log.warning("Workers limitados a %s por DB_MAX_CONNECTIONS", workers)
+
+
+def post_fork(server, worker):
+    # El pool creado en el maestro no debe compartirse entre procesos
+    from app.server import dispose_engine_after_fork
+    dispose_engine_after_fork()
+    worker.fork_time = time.monotonic()
+
+
+def post_worker_init(worker):
+    # Se ejecuta antes de que el worker empiece a aceptar peticiones
+    from app.server import warm_up
+    warm_up_seconds = warm_up()
+    # Los workers del arranque inicial miden desde el inicio del maestro;
+    # los que se reinician después, desde su fork
+    since = _start if worker.age <= workers else worker.fork_time
+    elapsed = time.monotonic() - since
+    worker.log.info(
+        "Worker %s listo en %.3fs (precalentamiento %.3fs, presupuesto %.1fs)",
+        worker.pid, elapsed, warm_up_seconds, STARTUP_BUDGET,
+    )
+    if elapsed > STARTUP_BUDGET:
+        worker.log.warning("El arranque superó el presupuesto de %.1fs", STARTUP_BUDGET)
+
+
+def worker_exit(server, worker):
+    from prometheus_client import multiprocess
+    from app.database import engine, idempotency_engine
+    engine.dispose()
+    idempotency_engine.dispose()
+    # Retira las métricas "live" del worker; los contadores se conservan
+    multiprocess.mark_process_dead(worker.pid)
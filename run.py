@@ -1,5 +1,7 @@
 import uvicorn
 
+# Solo para desarrollo; en producción: gunicorn app.main:app (ver gunicorn.conf.py)
+
 if __name__ == "__main__":
     uvicorn.run(
         "app.main:app",
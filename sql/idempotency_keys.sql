@@ -0,0 +1,10 @@
+-- Tabla del almacén de claves de idempotencia (IDEMPOTENCY_STORE=db)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    clave VARCHAR(64) NOT NULL PRIMARY KEY,
+    huella VARCHAR(64) NOT NULL,
+    estado_http INT NULL,
+    cabeceras TEXT,
+    cuerpo MEDIUMBLOB,
+    fecha_expiracion DATETIME NOT NULL,
+    INDEX ix_idempotency_keys_fecha_expiracion (fecha_expiracion)
+);